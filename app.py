@@ -1,31 +1,108 @@
+import functools
+import hmac
 import json
 import os
 import sqlite3
+import threading
 import tkinter as tk
 from datetime import datetime
 from tkinter import filedialog, messagebox, ttk
 from typing import Dict, List, Optional, Tuple
 
-from openpyxl import Workbook
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas as pdf_canvas
+try:
+    from fastpbkdf2 import pbkdf2_hmac
+except ImportError:
+    from hashlib import pbkdf2_hmac
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 DB_PATH = os.path.join("data", "clients.db")
 DEFAULT_ACCENT = "#1f2937"
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA temp_store=MEMORY",
+)
+CLIENT_FIELDS = (
+    "kundennummer",
+    "ma",
+    "name",
+    "strasse",
+    "plz",
+    "ort",
+    "geburtsdatum",
+    "pg",
+    "versicherungsnummer",
+    "pflegekasse",
+    "telefon",
+    "preise",
+    "fahrtkosten",
+    "bemerkungen",
+)
+CLIENT_FIELD_INDEX = {field: index for index, field in enumerate(CLIENT_FIELDS)}
+CLIENT_COLUMNS = """
+    kundennummer, ma, name, strasse, plz, ort, geburtsdatum, pg,
+    versicherungsnummer, pflegekasse, telefon, preise, fahrtkosten,
+    bemerkungen, extra_fields
+"""
+INSERT_CLIENT_SQL = f"INSERT INTO clients ({CLIENT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+SELECT_CLIENTS_SQL = f"SELECT {CLIENT_COLUMNS} FROM clients ORDER BY id DESC"
+SELECT_CLIENT_SQL = f"SELECT {CLIENT_COLUMNS} FROM clients WHERE kundennummer = ?"
+CLIENT_SUMMARY_FIELDS = ("kundennummer", "name", "plz", "ort", "telefon", "pg", "pflegekasse")
+SELECT_CLIENT_SUMMARY_SQL = "SELECT {} FROM clients ORDER BY id DESC".format(
+    ", ".join(f"COALESCE({field}, '')" for field in CLIENT_SUMMARY_FIELDS)
+)
+UPSERT_SETTING_SQL = "INSERT INTO app_settings (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value"
+SELECT_SETTING_SQL = "SELECT value FROM app_settings WHERE key = ?"
+
+
+def dumps_json(value: Dict[str, str]) -> str:
+    if orjson is not None:
+        return orjson.dumps(value).decode("utf-8")
+    return json.dumps(value, ensure_ascii=False)
+
+
+def loads_json(text: Optional[str]) -> Dict[str, str]:
+    if not text:
+        return {}
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
 
 
 class Database:
     def __init__(self, path: str = DB_PATH):
         self.path = path
+        self._lock = threading.RLock()
+        self._client_rows_cache: Optional[Tuple[List[Tuple[str, ...]], List[str]]] = None
+        self._verify_hash = functools.lru_cache(maxsize=32)(self._hash_password)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = self._open_connection()
         self._ensure_db()
 
+    def _open_connection(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
     def _connect(self) -> sqlite3.Connection:
-        return sqlite3.connect(self.path)
+        return self._conn
+
+    def close(self) -> None:
+        with self._lock:
+            self._verify_hash.cache_clear()
+            self._client_rows_cache = None
+            self._conn.close()
 
     def _ensure_db(self) -> None:
-        os.makedirs(os.path.dirname(self.path), exist_ok=True)
-        with self._connect() as conn:
+        with self._lock, self._connect() as conn:
             conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS users (
@@ -68,9 +145,7 @@ class Database:
             )
 
     def _hash_password(self, password: str, salt: str) -> str:
-        import hashlib
-
-        hashed = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt.encode("utf-8"), 120000)
+        hashed = pbkdf2_hmac("sha256", password.encode("utf-8"), salt.encode("utf-8"), 120000)
         return hashed.hex()
 
     def create_user(self, username: str, password: str) -> bool:
@@ -79,7 +154,7 @@ class Database:
         salt = secrets.token_hex(16)
         password_hash = self._hash_password(password, salt)
         try:
-            with self._connect() as conn:
+            with self._lock, self._connect() as conn:
                 conn.execute(
                     "INSERT INTO users (username, password_hash, salt) VALUES (?, ?, ?)",
                     (username, password_hash, salt),
@@ -89,94 +164,130 @@ class Database:
             return False
 
     def validate_user(self, username: str, password: str) -> bool:
-        with self._connect() as conn:
+        with self._lock:
+            conn = self._connect()
             row = conn.execute(
                 "SELECT password_hash, salt FROM users WHERE username = ?", (username,)
             ).fetchone()
         if not row:
             return False
         password_hash, salt = row
-        return password_hash == self._hash_password(password, salt)
+        return hmac.compare_digest(password_hash, self._verify_hash(password, salt))
+
+    def _last_client_id(self) -> int:
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'clients'").fetchone()
+            if not row:
+                row = conn.execute("SELECT MAX(id) FROM clients").fetchone()
+        return row[0] or 0
 
     def _next_kundennummer(self) -> str:
-        with self._connect() as conn:
-            row = conn.execute("SELECT MAX(id) FROM clients").fetchone()
-        next_id = (row[0] or 0) + 1
-        return f"K-{next_id:05d}"
+        return self._format_kundennummer(self._last_client_id() + 1)
+
+    @staticmethod
+    def _format_kundennummer(client_id: int) -> str:
+        return f"K-{client_id:05d}"
+
+    @staticmethod
+    def _client_params(kundennummer: str, data: Dict[str, str], extra_fields: Dict[str, str]) -> Tuple:
+        return (
+            kundennummer,
+            data.get("ma"),
+            data.get("name"),
+            data.get("strasse"),
+            data.get("plz"),
+            data.get("ort"),
+            data.get("geburtsdatum"),
+            data.get("pg"),
+            data.get("versicherungsnummer"),
+            data.get("pflegekasse"),
+            data.get("telefon"),
+            data.get("preise"),
+            data.get("fahrtkosten"),
+            data.get("bemerkungen"),
+            dumps_json(extra_fields),
+        )
 
     def save_client(self, data: Dict[str, str], extra_fields: Dict[str, str]) -> None:
         kundennummer = data.get("kundennummer") or self._next_kundennummer()
-        with self._connect() as conn:
-            conn.execute(
-                """
-                INSERT INTO clients (
-                    kundennummer, ma, name, strasse, plz, ort, geburtsdatum, pg,
-                    versicherungsnummer, pflegekasse, telefon, preise, fahrtkosten,
-                    bemerkungen, extra_fields
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    kundennummer,
-                    data.get("ma"),
-                    data.get("name"),
-                    data.get("strasse"),
-                    data.get("plz"),
-                    data.get("ort"),
-                    data.get("geburtsdatum"),
-                    data.get("pg"),
-                    data.get("versicherungsnummer"),
-                    data.get("pflegekasse"),
-                    data.get("telefon"),
-                    data.get("preise"),
-                    data.get("fahrtkosten"),
-                    data.get("bemerkungen"),
-                    json.dumps(extra_fields, ensure_ascii=False),
-                ),
-            )
+        with self._lock, self._connect() as conn:
+            conn.execute(INSERT_CLIENT_SQL, self._client_params(kundennummer, data, extra_fields))
+            self._client_rows_cache = None
+
+    def save_clients_bulk(self, rows: List[Tuple[Dict[str, str], Dict[str, str]]]) -> None:
+        with self._lock, self._connect() as conn:
+            next_id = self._last_client_id() + 1
+            params = []
+            for offset, (data, extra_fields) in enumerate(rows):
+                kundennummer = data.get("kundennummer") or self._format_kundennummer(next_id + offset)
+                params.append(self._client_params(kundennummer, data, extra_fields))
+            conn.executemany(INSERT_CLIENT_SQL, params)
+            self._client_rows_cache = None
+
+    @staticmethod
+    def _client_from_row(row: Tuple) -> Dict[str, str]:
+        client = dict(zip(CLIENT_FIELDS, [value or "" for value in row[:14]]))
+        extra = loads_json(row[14])
+        client.update(extra)
+        return client
 
     def list_clients(self) -> List[Dict[str, str]]:
-        with self._connect() as conn:
-            rows = conn.execute(
-                """
-                SELECT kundennummer, ma, name, strasse, plz, ort, geburtsdatum, pg,
-                       versicherungsnummer, pflegekasse, telefon, preise, fahrtkosten,
-                       bemerkungen, extra_fields
-                FROM clients ORDER BY id DESC
-                """
-            ).fetchall()
-        clients: List[Dict[str, str]] = []
-        for row in rows:
-            client = {
-                "kundennummer": row[0],
-                "ma": row[1] or "",
-                "name": row[2] or "",
-                "strasse": row[3] or "",
-                "plz": row[4] or "",
-                "ort": row[5] or "",
-                "geburtsdatum": row[6] or "",
-                "pg": row[7] or "",
-                "versicherungsnummer": row[8] or "",
-                "pflegekasse": row[9] or "",
-                "telefon": row[10] or "",
-                "preise": row[11] or "",
-                "fahrtkosten": row[12] or "",
-                "bemerkungen": row[13] or "",
-            }
-            extra = json.loads(row[14] or "{}")
-            client.update(extra)
-            clients.append(client)
-        return clients
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute(SELECT_CLIENTS_SQL).fetchall()
+        return [self._client_from_row(row) for row in rows]
+
+    def list_clients_rows(self) -> Tuple[List[Tuple[str, ...]], List[str]]:
+        with self._lock:
+            if self._client_rows_cache is not None:
+                client_rows, extra_keys = self._client_rows_cache
+                return list(client_rows), list(extra_keys)
+            conn = self._connect()
+            rows = conn.execute(SELECT_CLIENTS_SQL).fetchall()
+            extras = [loads_json(row[14]) for row in rows]
+            extra_keys = list(dict.fromkeys(key for extra in extras for key in extra if key not in CLIENT_FIELDS))
+            padding = ("",) * len(extra_keys)
+            client_rows: List[Tuple[str, ...]] = []
+            for row, extra in zip(rows, extras):
+                if not extra:
+                    client_rows.append(tuple(value or "" for value in row[:14]) + padding)
+                    continue
+                base = [value or "" for value in row[:14]]
+                for key, value in extra.items():
+                    index = CLIENT_FIELD_INDEX.get(key)
+                    if index is not None:
+                        base[index] = value
+                client_rows.append(tuple(base) + tuple(extra.get(key, "") for key in extra_keys))
+            self._client_rows_cache = (client_rows, extra_keys)
+        return list(client_rows), list(extra_keys)
+
+    def list_clients_summary(self) -> List[Tuple[str, ...]]:
+        with self._lock:
+            conn = self._connect()
+            return conn.execute(SELECT_CLIENT_SUMMARY_SQL).fetchall()
+
+    def get_client(self, kundennummer: str) -> Optional[Dict[str, str]]:
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(SELECT_CLIENT_SQL, (kundennummer,)).fetchone()
+        if not row:
+            return None
+        return self._client_from_row(row)
 
     def save_setting(self, key: str, value: str) -> None:
-        with self._connect() as conn:
-            conn.execute(
-                "INSERT INTO app_settings (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
-                (key, value),
-            )
+        with self._lock, self._connect() as conn:
+            conn.execute(UPSERT_SETTING_SQL, (key, value))
+
+    def save_settings(self, settings: Dict[str, str]) -> Dict[str, str]:
+        with self._lock, self._connect() as conn:
+            conn.executemany(UPSERT_SETTING_SQL, settings.items())
+        return dict(settings)
 
     def load_setting(self, key: str, default: str = "") -> str:
-        with self._connect() as conn:
-            row = conn.execute("SELECT value FROM app_settings WHERE key = ?", (key,)).fetchone()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(SELECT_SETTING_SQL, (key,)).fetchone()
         if row:
             return row[0]
         return default
@@ -210,58 +321,104 @@ class AuthWindow(tk.Toplevel):
         actions = tk.Frame(container, bg="white")
         actions.pack(fill=tk.X)
 
-        login_btn = tk.Button(actions, text="Anmelden", command=self._handle_login, bg=DEFAULT_ACCENT, fg="white", relief="flat", padx=12, pady=8)
-        login_btn.pack(side=tk.LEFT, expand=True, fill=tk.X, padx=(0, 5))
+        self.login_btn = tk.Button(actions, text="Anmelden", command=self._handle_login, bg=DEFAULT_ACCENT, fg="white", relief="flat", padx=12, pady=8)
+        self.login_btn.pack(side=tk.LEFT, expand=True, fill=tk.X, padx=(0, 5))
 
-        register_btn = tk.Button(actions, text="Registrieren", command=self._handle_register, bg="#e5e7eb", fg="#111827", relief="flat", padx=12, pady=8)
-        register_btn.pack(side=tk.LEFT, expand=True, fill=tk.X, padx=(5, 0))
+        self.register_btn = tk.Button(actions, text="Registrieren", command=self._handle_register, bg="#e5e7eb", fg="#111827", relief="flat", padx=12, pady=8)
+        self.register_btn.pack(side=tk.LEFT, expand=True, fill=tk.X, padx=(5, 0))
 
-    def _handle_login(self) -> None:
+    def _read_credentials(self) -> Optional[Tuple[str, str]]:
         username = self.username_var.get().strip()
         password = self.password_var.get().strip()
         if not username or not password:
             messagebox.showwarning("Hinweis", "Bitte Benutzername und Passwort eingeben.")
+            return None
+        return username, password
+
+    def _set_busy(self, busy: bool) -> None:
+        state = "disabled" if busy else "normal"
+        self.login_btn.configure(state=state)
+        self.register_btn.configure(state=state)
+
+    def _handle_login(self) -> None:
+        credentials = self._read_credentials()
+        if not credentials:
             return
-        if self.db.validate_user(username, password):
+        self._set_busy(True)
+        threading.Thread(target=self._do_login, args=credentials, daemon=True).start()
+
+    def _do_login(self, username: str, password: str) -> None:
+        try:
+            ok = self.db.validate_user(username, password)
+        except Exception as exc:
+            self.after(0, self._finish_failed, exc)
+            return
+        self.after(0, self._finish_login, username, ok)
+
+    def _finish_login(self, username: str, ok: bool) -> None:
+        if ok:
             self.master.on_login_success(username)
             self.destroy()
         else:
+            self._set_busy(False)
             messagebox.showerror("Fehler", "Ungültige Zugangsdaten.")
 
     def _handle_register(self) -> None:
-        username = self.username_var.get().strip()
-        password = self.password_var.get().strip()
-        if not username or not password:
-            messagebox.showwarning("Hinweis", "Bitte Benutzername und Passwort eingeben.")
+        credentials = self._read_credentials()
+        if not credentials:
+            return
+        self._set_busy(True)
+        threading.Thread(target=self._do_register, args=credentials, daemon=True).start()
+
+    def _do_register(self, username: str, password: str) -> None:
+        try:
+            created = self.db.create_user(username, password)
+        except Exception as exc:
+            self.after(0, self._finish_failed, exc)
             return
-        created = self.db.create_user(username, password)
+        self.after(0, self._finish_register, created)
+
+    def _finish_register(self, created: bool) -> None:
+        self._set_busy(False)
         if created:
             messagebox.showinfo("Erfolg", "Konto erstellt. Sie können sich jetzt anmelden.")
         else:
             messagebox.showerror("Fehler", "Benutzername bereits vergeben.")
 
+    def _finish_failed(self, error: Exception) -> None:
+        self._set_busy(False)
+        messagebox.showerror("Fehler", f"Vorgang fehlgeschlagen: {error}")
+
 
 class SignaturePad(tk.Canvas):
     def __init__(self, master: tk.Widget, **kwargs):
         super().__init__(master, **kwargs)
         self.strokes: List[List[Tuple[int, int]]] = []
         self.current_stroke: List[Tuple[int, int]] = []
+        self._line_id: Optional[int] = None
+        self._line_coords: List[int] = []
         self.bind("<ButtonPress-1>", self._start)
         self.bind("<B1-Motion>", self._draw)
         self.bind("<ButtonRelease-1>", self._end)
 
     def _start(self, event: tk.Event) -> None:
         self.current_stroke = [(event.x, event.y)]
+        self._line_coords = [event.x, event.y, event.x, event.y]
+        self._line_id = self.create_line(*self._line_coords, width=2, fill="#111827", capstyle=tk.ROUND, joinstyle=tk.ROUND, smooth=True)
 
     def _draw(self, event: tk.Event) -> None:
-        last_point = self.current_stroke[-1]
-        self.create_line(last_point[0], last_point[1], event.x, event.y, width=2, fill="#111827", capstyle=tk.ROUND)
+        if self._line_id is None:
+            return
         self.current_stroke.append((event.x, event.y))
+        self._line_coords.extend((event.x, event.y))
+        self.coords(self._line_id, *self._line_coords)
 
     def _end(self, _: tk.Event) -> None:
         if self.current_stroke:
             self.strokes.append(self.current_stroke)
             self.current_stroke = []
+        self._line_id = None
+        self._line_coords = []
 
     def clear(self) -> None:
         self.delete("all")
@@ -410,15 +567,7 @@ class ClientApp(tk.Tk):
         list_frame = tk.Frame(content, bg="white")
         list_frame.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True)
 
-        columns = (
-            "kundennummer",
-            "name",
-            "plz",
-            "ort",
-            "telefon",
-            "pg",
-            "pflegekasse",
-        )
+        columns = CLIENT_SUMMARY_FIELDS
         self.tree = ttk.Treeview(list_frame, columns=columns, show="headings", height=20)
         headings = {
             "kundennummer": "Kundennummer",
@@ -505,33 +654,27 @@ class ClientApp(tk.Tk):
         self._load_clients()
 
     def _load_clients(self) -> None:
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        for client in self.db.list_clients():
-            self.tree.insert("", tk.END, values=(
-                client.get("kundennummer"),
-                client.get("name"),
-                client.get("plz"),
-                client.get("ort"),
-                client.get("telefon"),
-                client.get("pg"),
-                client.get("pflegekasse"),
-            ))
+        rows = self.db.list_clients_summary()
+        self.tree.delete(*self.tree.get_children())
+        insert = self.tree.insert
+        for values in rows:
+            insert("", tk.END, values=values)
 
     def _export_excel(self) -> None:
-        clients = self.db.list_clients()
-        if not clients:
+        rows, extra_keys = self.db.list_clients_rows()
+        if not rows:
             messagebox.showinfo("Hinweis", "Keine Kunden zum Exportieren.")
             return
-        workbook = Workbook()
-        sheet = workbook.active
-        headers = list(clients[0].keys())
-        sheet.append(headers)
-        for client in clients:
-            sheet.append([client.get(h, "") for h in headers])
         file_path = filedialog.asksaveasfilename(defaultextension=".xlsx", filetypes=[("Excel", "*.xlsx")])
         if not file_path:
             return
+        from openpyxl import Workbook
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(list(CLIENT_FIELDS) + extra_keys)
+        for row in rows:
+            sheet.append(row)
         workbook.save(file_path)
         messagebox.showinfo("Erfolg", f"Excel wurde gespeichert: {file_path}")
 
@@ -542,7 +685,7 @@ class ClientApp(tk.Tk):
             return
         values = self.tree.item(selected, "values")
         kundennummer = values[0]
-        client = next((c for c in self.db.list_clients() if c.get("kundennummer") == kundennummer), None)
+        client = self.db.get_client(kundennummer)
         if not client:
             messagebox.showerror("Fehler", "Kunde nicht gefunden.")
             return
@@ -613,6 +756,9 @@ class ContractWindow(tk.Toplevel):
         file_path = filedialog.asksaveasfilename(defaultextension=".pdf", filetypes=[("PDF", "*.pdf")])
         if not file_path:
             return
+        from reportlab.lib.pagesizes import A4
+        from reportlab.pdfgen import canvas as pdf_canvas
+
         pdf = pdf_canvas.Canvas(file_path, pagesize=A4)
         width, height = A4
         y = height - 60
@@ -641,11 +787,13 @@ class ContractWindow(tk.Toplevel):
         pdf.drawString(50, y, "Signatur")
         y -= 10
         pdf.setLineWidth(2)
-        for stroke in self.signature_pad.strokes:
-            for i in range(len(stroke) - 1):
-                p1 = stroke[i]
-                p2 = stroke[i + 1]
-                pdf.line(50 + p1[0], y + p1[1], 50 + p2[0], y + p2[1])
+        segments = [
+            (50 + x1, y + y1, 50 + x2, y + y2)
+            for stroke in self.signature_pad.strokes
+            for (x1, y1), (x2, y2) in zip(stroke, stroke[1:])
+        ]
+        if segments:
+            pdf.lines(segments)
         pdf.showPage()
         pdf.save()
         messagebox.showinfo("Erfolg", f"PDF gespeichert: {file_path}")
@@ -688,20 +836,25 @@ class SettingsWindow(tk.Toplevel):
             self.logo_var.set(file_path)
 
     def _save(self) -> None:
-        self.db.save_setting("company_name", self.company_var.get().strip())
-        self.db.save_setting("logo_path", self.logo_var.get().strip())
-        self.db.save_setting("accent_color", self.color_var.get().strip() or DEFAULT_ACCENT)
-        self.master_app.accent_color = self.db.load_setting("accent_color", DEFAULT_ACCENT)
-        self.master_app.company_name = self.db.load_setting("company_name", "")
-        self.master_app.logo_path = self.db.load_setting("logo_path", "")
+        settings = self.db.save_settings({
+            "company_name": self.company_var.get().strip(),
+            "logo_path": self.logo_var.get().strip(),
+            "accent_color": self.color_var.get().strip() or DEFAULT_ACCENT,
+        })
+        self.master_app.accent_color = settings["accent_color"]
+        self.master_app.company_name = settings["company_name"]
+        self.master_app.logo_path = settings["logo_path"]
         messagebox.showinfo("Gespeichert", "Branding aktualisiert. Starten Sie neu, um Farben vollständig zu übernehmen.")
         self.destroy()
 
 
 def main() -> None:
     db = Database()
-    app = ClientApp(db)
-    app.mainloop()
+    try:
+        app = ClientApp(db)
+        app.mainloop()
+    finally:
+        db.close()
 
 
 if __name__ == "__main__":